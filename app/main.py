@@ -1,16 +1,154 @@
 # app/main.py
 import uvicorn
-from fastapi import FastAPI, HTTPException, status, Depends
-from uuid import uuid4
-from datetime import datetime
+from fastapi import FastAPI, HTTPException, Request, status, Depends, Response
+from fastapi.responses import ORJSONResponse
 import os
+import re
+import asyncio
+from datetime import datetime
+from uuid import UUID
+from typing import Optional
+import logging
+import neo4j
+try:
+    # private driver API, only used for the startup log line; don't let a
+    # driver release that moves it stop the app from importing
+    from neo4j._codec.packstream import RUST_AVAILABLE
+except ImportError:
+    RUST_AVAILABLE = "unknown"
+from cachetools import TTLCache
 from dotenv import load_dotenv
-from app.neo4j_driver import neo4j_driver
+from app.neo4j_driver import neo4j_driver, QueryTimeout
 from app import schemas
 
 load_dotenv()
 
-app = FastAPI(title="FastAPI + Neo4j Social API")
+# uvicorn only configures handlers for its own loggers, so log through
+# uvicorn.error to have app messages show up next to the server's
+logger = logging.getLogger("uvicorn.error")
+
+# short-lived caches for the hot single-entity reads. Writes pop the entries
+# they change, but only in the process that handled the write: with several
+# workers the others keep serving the old value until the TTL expires. A read
+# that started before a write can also put its older result back after the
+# pop. Either way a cached user or post is at most 30s stale; set CACHE=0
+# where that isn't acceptable
+CACHE_ENABLED = os.getenv("CACHE", "1") == "1"
+USER_CACHE = TTLCache(maxsize=10_000, ttl=30)
+POST_CACHE = TTLCache(maxsize=10_000, ttl=30)
+
+# writes the client doesn't wait for; referenced here so they aren't garbage
+# collected mid-flight, and drained on shutdown
+_background_tasks = set()
+
+# Cypher queries are kept as module constants so every request sends the
+# exact same text and hits the server's query plan cache
+
+# follower/following/post/like counts are stored on the nodes and kept up to
+# date by the write queries, so reads don't have to count relationships.
+# Nodes created before that have no counters (reads return null) until
+# `python -m app.migrations` has been run, see README.md
+CYPHER_CREATE_USER = """
+CREATE (u:User {
+    id: randomUUID(), username: $username, name: $name, bio: $bio, created_at: datetime(),
+    following_count: 0, followers_count: 0, posts_count: 0
+})
+RETURN u.id AS id, u.username AS username, u.name AS name, u.bio AS bio
+"""
+
+CYPHER_GET_USER = """
+MATCH (u:User {username: $username})
+RETURN u.id AS id, u.username AS username, u.name AS name, u.bio AS bio,
+       u.following_count AS following_count, u.followers_count AS followers_count,
+       u.posts_count AS posts_count
+"""
+
+CYPHER_FOLLOW = """
+MATCH (a:User {username: $a}), (b:User {username: $b})
+MERGE (a)-[r:FOLLOWS]->(b)
+ON CREATE SET a.following_count = coalesce(a.following_count, 0) + 1,
+              b.followers_count = coalesce(b.followers_count, 0) + 1
+RETURN a.username AS follower, b.username AS followee
+"""
+
+CYPHER_FOLLOW_BATCH = """
+UNWIND $rows AS r
+MATCH (a:User {username: r.follower_username}), (b:User {username: r.followee_username})
+MERGE (a)-[:FOLLOWS]->(b)
+ON CREATE SET a.following_count = coalesce(a.following_count, 0) + 1,
+              b.followers_count = coalesce(b.followers_count, 0) + 1
+RETURN r.idx AS idx
+"""
+
+# the _LOCK_ write takes write locks on both users before the relationship is
+# matched, so concurrent unfollows of the same pair run one after the other
+# and only the one that actually deletes it decrements the counters
+CYPHER_UNFOLLOW = """
+MATCH (a:User {username: $a}), (b:User {username: $b})
+SET a._LOCK_ = true, b._LOCK_ = true
+REMOVE a._LOCK_, b._LOCK_
+WITH a, b
+MATCH (a)-[r:FOLLOWS]->(b)
+DELETE r
+SET a.following_count = coalesce(a.following_count, 0) - 1,
+    b.followers_count = coalesce(b.followers_count, 0) - 1
+RETURN count(r) AS deleted
+"""
+
+CYPHER_CREATE_POST = """
+MATCH (a:User {username: $author_username})
+CREATE (p:Post {id: randomUUID(), content: $content, created_at: datetime(), likes_count: 0})
+CREATE (a)-[:POSTED]->(p)
+SET a.posts_count = coalesce(a.posts_count, 0) + 1
+RETURN p.id AS id, a.username AS author_username, p.content AS content, toString(p.created_at) AS created_at
+"""
+
+CYPHER_CREATE_POSTS_BATCH = """
+UNWIND $rows AS r
+MATCH (a:User {username: r.author_username})
+CREATE (p:Post {id: randomUUID(), content: r.content, created_at: datetime(), likes_count: 0})
+CREATE (a)-[:POSTED]->(p)
+SET a.posts_count = coalesce(a.posts_count, 0) + 1
+RETURN r.idx AS idx, p.id AS id, a.username AS author_username, p.content AS content,
+       toString(p.created_at) AS created_at
+"""
+
+CYPHER_GET_POST = """
+MATCH (p:Post {id: $id})<-[:POSTED]-(a:User)
+RETURN p.id AS id, a.username AS author_username, p.content AS content, toString(p.created_at) AS created_at, p.likes_count AS likes
+"""
+
+CYPHER_LIKE_POST = """
+MATCH (u:User {username: $username}), (p:Post {id: $post_id})
+MERGE (u)-[:LIKED]->(p)
+ON CREATE SET p.likes_count = coalesce(p.likes_count, 0) + 1
+RETURN u.username AS username, p.id AS post_id
+"""
+
+CYPHER_LIKE_BATCH = """
+UNWIND $rows AS r
+MATCH (u:User {username: r.username}), (p:Post {id: r.post_id})
+MERGE (u)-[:LIKED]->(p)
+ON CREATE SET p.likes_count = coalesce(p.likes_count, 0) + 1
+RETURN r.idx AS idx
+"""
+
+CYPHER_GET_FEED = """
+MATCH (me:User {username: $username})-[:FOLLOWS]->(other:User)-[:POSTED]->(p:Post)
+WHERE $cursor_at IS NULL
+   OR p.created_at < datetime($cursor_at)
+   OR (p.created_at = datetime($cursor_at) AND p.id < $cursor_id)
+RETURN p.id AS id, other.username AS author_username, p.content AS content, toString(p.created_at) AS created_at
+ORDER BY p.created_at DESC, p.id DESC
+LIMIT $limit
+"""
+
+app = FastAPI(title="FastAPI + Neo4j Social API", default_response_class=ORJSONResponse)
+
+# reads that hit their server-side timeout answer 504 instead of a bare 500
+@app.exception_handler(QueryTimeout)
+async def query_timeout_handler(request: Request, exc: QueryTimeout):
+    return ORJSONResponse(status_code=status.HTTP_504_GATEWAY_TIMEOUT, content={"detail": "Database query timed out"})
 
 @app.get("/")
 async def root():
@@ -20,14 +158,24 @@ async def root():
 # startup/shutdown
 @app.on_event("startup")
 async def startup():
-    neo4j_driver.init_app()
+    # neo4j-rust-ext has no module of its own; it installs a packstream codec
+    # into the neo4j package, which the driver picks up when it can load it
+    logger.info("neo4j driver %s (rust extension: %s)", neo4j.__version__, RUST_AVAILABLE)
+    await neo4j_driver.init_app()
     # create common constraints (run once is fine)
     # unique username and unique post id
     await neo4j_driver.execute_write("CREATE CONSTRAINT IF NOT EXISTS FOR (u:User) REQUIRE u.username IS UNIQUE")
     await neo4j_driver.execute_write("CREATE CONSTRAINT IF NOT EXISTS FOR (p:Post) REQUIRE p.id IS UNIQUE")
+    # range index for queries that filter or order Post nodes by created_at. The
+    # feed query starts from the user and walks FOLLOWS/POSTED, so the planner
+    # doesn't use it there: the feed still sorts its candidate posts
+    await neo4j_driver.execute_write("CREATE INDEX post_created_at IF NOT EXISTS FOR (p:Post) ON (p.created_at)")
+    # data fixes for nodes written by older versions live in app/migrations.py
 
 @app.on_event("shutdown")
 async def shutdown():
+    if _background_tasks:
+        await asyncio.gather(*_background_tasks, return_exceptions=True)
     await neo4j_driver.close()
 
 # Helper to return single record or raise
@@ -38,136 +186,194 @@ def _single_or_none(records):
     # each dict will contain the named return keys from cypher
     return records[0]
 
+# Batch rows carry their position in the request as idx and the UNWIND
+# queries return it for every row they applied; the rest were skipped
+def _batch_rows(items):
+    return [{**item.model_dump(), "idx": i} for i, item in enumerate(items)]
+
+def _skipped(rows, records):
+    applied = {rec["idx"] for rec in records}
+    return [row["idx"] for row in rows if row["idx"] not in applied]
+
+def _log_task_error(task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("background write failed", exc_info=task.exception())
+
+def _run_in_background(coro):
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    task.add_done_callback(_log_task_error)
+    return task
+
 # Users
 @app.post("/users", response_model=schemas.UserOut, status_code=status.HTTP_201_CREATED)
 async def create_user(payload: schemas.UserCreate):
-    user_id = str(uuid4())
-    created_at = datetime.utcnow().isoformat()
-    cypher = """
-    CREATE (u:User {
-        id: $id, username: $username, name: $name, bio: $bio, created_at: $created_at
-    })
-    RETURN u.id AS id, u.username AS username, u.name AS name, u.bio AS bio
-    """
     params = {
-        "id": user_id,
         "username": payload.username,
         "name": payload.name,
-        "bio": payload.bio,
-        "created_at": created_at
+        "bio": payload.bio
     }
     try:
-        records = await neo4j_driver.execute_write(cypher, params)
+        records = await neo4j_driver.execute_write(CYPHER_CREATE_USER, params)
     except Exception as e:
         # likely uniqueness constraint violation
         raise HTTPException(status_code=400, detail=str(e))
+    USER_CACHE.pop(payload.username, None)
     rec = _single_or_none(records)
     return rec
 
 @app.get("/users/{username}", response_model=dict)
 async def get_user(username: str):
-    cypher = """
-    MATCH (u:User {username: $username})
-    OPTIONAL MATCH (u)-[:FOLLOWS]->(f:User)
-    OPTIONAL MATCH (g:User)-[:FOLLOWS]->(u)
-    OPTIONAL MATCH (u)-[:POSTED]->(p:Post)
-    RETURN u.id AS id, u.username AS username, u.name AS name, u.bio AS bio,
-           count(DISTINCT f) AS following_count, count(DISTINCT g) AS followers_count,
-           count(DISTINCT p) AS posts_count
-    """
-    records = await neo4j_driver.execute_read(cypher, {"username": username})
+    rec = USER_CACHE.get(username)
+    if rec is not None:
+        return rec
+    records = await neo4j_driver.execute_read(CYPHER_GET_USER, {"username": username}, timeout=1.0)
     rec = _single_or_none(records)
     if not rec:
         raise HTTPException(status_code=404, detail="User not found")
+    if CACHE_ENABLED:
+        USER_CACHE[username] = rec
     return rec
 
 # Follow
 @app.post("/follow", status_code=201)
 async def follow(action: schemas.FollowAction):
-    cypher = """
-    MATCH (a:User {username: $a}), (b:User {username: $b})
-    MERGE (a)-[r:FOLLOWS]->(b)
-    RETURN a.username AS follower, b.username AS followee
-    """
     params = {"a": action.follower_username, "b": action.followee_username}
-    records = await neo4j_driver.execute_write(cypher, params)
+    records = await neo4j_driver.execute_write(CYPHER_FOLLOW, params)
+    USER_CACHE.pop(action.follower_username, None)
+    USER_CACHE.pop(action.followee_username, None)
     if not records:
         raise HTTPException(status_code=404, detail="One or both users not found")
     return {"detail": "OK", "data": records[0]}
 
+@app.post("/follow/batch", response_model=schemas.BatchOut, status_code=201)
+async def follow_batch(payload: schemas.FollowBatch):
+    rows = _batch_rows(payload.items)
+    records = await neo4j_driver.execute_write(CYPHER_FOLLOW_BATCH, {"rows": rows})
+    for a in payload.items:
+        USER_CACHE.pop(a.follower_username, None)
+        USER_CACHE.pop(a.followee_username, None)
+    return {"matched": len(records), "skipped": _skipped(rows, records)}
+
 # Unfollow
-@app.post("/unfollow", status_code=200)
-async def unfollow(action: schemas.FollowAction):
-    cypher = """
-    MATCH (a:User {username: $a})-[r:FOLLOWS]->(b:User {username: $b})
-    DELETE r
-    RETURN count(r) AS deleted
-    """
+async def _unfollow(action: schemas.FollowAction):
     params = {"a": action.follower_username, "b": action.followee_username}
-    await neo4j_driver.execute_write(cypher, params)
-    return {"detail": "OK"}
+    await neo4j_driver.execute_write(CYPHER_UNFOLLOW, params)
+    USER_CACHE.pop(action.follower_username, None)
+    USER_CACHE.pop(action.followee_username, None)
+
+# idempotent and returns nothing, so the write runs in the background. The 202
+# comes back before the write commits and carries nothing to wait on, so for a
+# short while reads (including the client's own) can still see the follow
+@app.post("/unfollow", status_code=status.HTTP_202_ACCEPTED)
+async def unfollow(action: schemas.FollowAction):
+    _run_in_background(_unfollow(action))
+    return {"detail": "Accepted"}
 
 # Posts
 @app.post("/posts", response_model=schemas.PostOut, status_code=201)
 async def create_post(payload: schemas.PostCreate):
-    post_id = str(uuid4())
-    created_at = datetime.utcnow().isoformat()
-    cypher = """
-    MATCH (a:User {username: $author_username})
-    CREATE (p:Post {id: $id, content: $content, created_at: $created_at})
-    CREATE (a)-[:POSTED]->(p)
-    RETURN p.id AS id, a.username AS author_username, p.content AS content, p.created_at AS created_at
-    """
     params = {
-        "id": post_id,
         "content": payload.content,
-        "author_username": payload.author_username,
-        "created_at": created_at
+        "author_username": payload.author_username
     }
-    records = await neo4j_driver.execute_write(cypher, params)
+    records = await neo4j_driver.execute_write(CYPHER_CREATE_POST, params)
+    # posts_count of the author changed
+    USER_CACHE.pop(payload.author_username, None)
     rec = _single_or_none(records)
     if not rec:
         raise HTTPException(status_code=404, detail="Author not found")
     return rec
 
+@app.post("/posts/batch", response_model=schemas.PostBatchOut, status_code=201)
+async def create_posts_batch(payload: schemas.PostBatch):
+    rows = _batch_rows(payload.items)
+    records = await neo4j_driver.execute_write(CYPHER_CREATE_POSTS_BATCH, {"rows": rows})
+    for item in payload.items:
+        USER_CACHE.pop(item.author_username, None)
+    # posts whose author does not exist are not created
+    return {"created": records, "skipped": _skipped(rows, records)}
+
 @app.get("/posts/{post_id}", response_model=dict)
 async def get_post(post_id: str):
-    cypher = """
-    MATCH (p:Post {id: $id})<-[:POSTED]-(a:User)
-    OPTIONAL MATCH (u:User)-[:LIKED]->(p)
-    RETURN p.id AS id, a.username AS author_username, p.content AS content, p.created_at AS created_at, count(u) AS likes
-    """
-    records = await neo4j_driver.execute_read(cypher, {"id": post_id})
+    rec = POST_CACHE.get(post_id)
+    if rec is not None:
+        return rec
+    records = await neo4j_driver.execute_read(CYPHER_GET_POST, {"id": post_id}, timeout=1.0)
     rec = _single_or_none(records)
     if not rec:
         raise HTTPException(status_code=404, detail="Post not found")
+    if CACHE_ENABLED:
+        POST_CACHE[post_id] = rec
     return rec
 
 # Like post
 @app.post("/posts/{post_id}/like")
 async def like_post(post_id: str, payload: schemas.LikeAction):
-    cypher = """
-    MATCH (u:User {username: $username}), (p:Post {id: $post_id})
-    MERGE (u)-[:LIKED]->(p)
-    RETURN u.username AS username, p.id AS post_id
-    """
     params = {"username": payload.username, "post_id": post_id}
-    records = await neo4j_driver.execute_write(cypher, params)
+    records = await neo4j_driver.execute_write(CYPHER_LIKE_POST, params)
+    POST_CACHE.pop(post_id, None)
     if not records:
         raise HTTPException(status_code=404, detail="User or post not found")
     return {"detail": "liked", "data": records[0]}
 
+@app.post("/likes/batch", response_model=schemas.BatchOut)
+async def like_batch(payload: schemas.LikeBatch):
+    rows = _batch_rows(payload.items)
+    records = await neo4j_driver.execute_write(CYPHER_LIKE_BATCH, {"rows": rows})
+    for a in payload.items:
+        POST_CACHE.pop(a.post_id, None)
+    return {"matched": len(records), "skipped": _skipped(rows, records)}
+
+# Feed cursors are "<created_at>|<post id>" of the last post on a page; the id
+# breaks ties between posts with the same created_at (a /posts/batch call gives
+# all of its posts the same one). created_at must be in the form Neo4j prints
+# datetimes in: YYYY-MM-DDTHH:MM[:SS[.fraction]] with a Z or +HH:MM offset and
+# an optional [Region/City] zone name
+_CURSOR_AT_RE = re.compile(
+    r"(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}(?::\d{2}(?:\.\d{1,9})?)?)(Z|[+-]\d{2}:\d{2})(\[[\w/+-]+\])?"
+)
+
+def _parse_feed_cursor(cursor):
+    created_at, _, post_id = cursor.rpartition("|")
+    m = _CURSOR_AT_RE.fullmatch(created_at)
+    try:
+        if m is None:
+            raise ValueError(created_at)
+        # also reject out-of-range fields (month 13 etc.); Python only takes
+        # up to microseconds, so drop the rest of the fraction first
+        local = re.sub(r"(\.\d{6})\d+", r"\1", m.group(1))
+        datetime.fromisoformat(local + m.group(2).replace("Z", "+00:00"))
+        UUID(post_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return created_at, post_id
+
 # Feed: posts from people the user follows (latest first)
-@app.get("/feed/{username}", response_model=list)
-async def get_feed(username: str, limit: int = 20):
-    cypher = """
-    MATCH (me:User {username: $username})-[:FOLLOWS]->(other:User)-[:POSTED]->(p:Post)
-    RETURN p.id AS id, other.username AS author_username, p.content AS content, p.created_at AS created_at
-    ORDER BY p.created_at DESC
-    LIMIT $limit
-    """
-    records = await neo4j_driver.execute_read(cypher, {"username": username, "limit": limit})
-    return records
+# Pass the X-Next-Cursor header of one page as ?cursor= to get the next one.
+# Clients must URL-encode it: an unencoded "+" in the offset arrives as a space
+@app.get("/feed/{username}", response_model=list[schemas.PostOut])
+async def get_feed(response: Response, username: str, limit: int = 20, cursor: Optional[str] = None):
+    cursor_at, cursor_id = _parse_feed_cursor(cursor) if cursor else (None, None)
+    params = {"username": username, "limit": limit, "cursor_at": cursor_at, "cursor_id": cursor_id}
+    keys, rows = await neo4j_driver.execute_read_values(CYPHER_GET_FEED, params, timeout=2.0)
+    if rows and len(rows) == limit:
+        last = dict(zip(keys, rows[-1]))
+        response.headers["X-Next-Cursor"] = f"{last['created_at']}|{last['id']}"
+    return [dict(zip(keys, row)) for row in rows]
 
 if __name__ == "__main__":
-    uvicorn.run("app.main:app", host=os.getenv("APP_HOST", "0.0.0.0"), port=int(os.getenv("APP_PORT", 8000)), reload=True)
+    # loop="auto" uses uvloop where uvicorn[standard] installs it (not on Windows
+    # or PyPy) and falls back to asyncio elsewhere. uvicorn ignores workers while
+    # reloading, so they only apply with APP_RELOAD=false
+    reload = os.getenv("APP_RELOAD", "true").lower() == "true"
+    uvicorn.run(
+        "app.main:app",
+        host=os.getenv("APP_HOST", "0.0.0.0"),
+        port=int(os.getenv("APP_PORT", 8000)),
+        loop="auto",
+        http="httptools",
+        workers=1 if reload else int(os.getenv("WORKERS", "2")),
+        reload=reload,
+    )
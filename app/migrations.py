@@ -0,0 +1,58 @@
+# app/migrations.py
+# One-off data migrations. These are not run at startup; run them once after
+# deploying the version that needs them:
+#
+#     python -m app.migrations
+#
+# Re-running them is harmless.
+# They use CALL { ... } IN TRANSACTIONS, which has to run in an auto-commit
+# transaction, so they go through session.run rather than execute_query.
+import asyncio
+from app.neo4j_driver import neo4j_driver, NEO4J_DATABASE
+
+# timestamps written as ISO strings by older versions -> native datetimes
+CYPHER_POST_CREATED_AT_TO_DATETIME = """
+MATCH (p:Post) WHERE p.created_at IS :: STRING
+CALL { WITH p SET p.created_at = datetime(p.created_at) } IN TRANSACTIONS OF 10000 ROWS
+"""
+
+# denormalized counters for nodes created before the write queries kept them.
+# Recomputed for every node: an old node touched by a write before this ran
+# has some counters started from 0 instead of its real count
+CYPHER_BACKFILL_USER_COUNTS = """
+MATCH (u:User)
+CALL {
+    WITH u
+    SET u.following_count = COUNT { (u)-[:FOLLOWS]->(:User) },
+        u.followers_count = COUNT { (:User)-[:FOLLOWS]->(u) },
+        u.posts_count = COUNT { (u)-[:POSTED]->(:Post) }
+} IN TRANSACTIONS OF 10000 ROWS
+"""
+
+CYPHER_BACKFILL_POST_COUNTS = """
+MATCH (p:Post)
+CALL {
+    WITH p
+    SET p.likes_count = COUNT { (:User)-[:LIKED]->(p) }
+} IN TRANSACTIONS OF 10000 ROWS
+"""
+
+MIGRATIONS = [
+    ("post created_at to datetime", CYPHER_POST_CREATED_AT_TO_DATETIME),
+    ("user counters", CYPHER_BACKFILL_USER_COUNTS),
+    ("post counters", CYPHER_BACKFILL_POST_COUNTS),
+]
+
+async def main():
+    await neo4j_driver.init_app()
+    try:
+        async with neo4j_driver.driver.session(database=NEO4J_DATABASE) as session:
+            for name, cypher in MIGRATIONS:
+                result = await session.run(cypher)
+                summary = await result.consume()
+                print(f"{name}: {summary.counters.properties_set} properties set")
+    finally:
+        await neo4j_driver.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
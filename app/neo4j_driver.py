@@ -1,4 +1,6 @@
 # app/neo4j_driver.py
+import asyncio
+import neo4j
 from neo4j import AsyncGraphDatabase
 import os
 from dotenv import load_dotenv
@@ -8,37 +10,73 @@ load_dotenv()
 NEO4J_URI = os.getenv("NEO4J_URI", "bolt://localhost:7687")
 NEO4J_USER = os.getenv("NEO4J_USER", "neo4j")
 NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD", "test")
+NEO4J_DATABASE = os.getenv("NEO4J_DATABASE", "neo4j")
+NEO4J_POOL = int(os.getenv("NEO4J_POOL", "50"))
+NEO4J_ACQ_TIMEOUT = float(os.getenv("NEO4J_ACQ_TIMEOUT", "60.0"))
+
+class QueryTimeout(Exception):
+    # a read ran past the timeout it was given and the server aborted it
+    pass
 
 class Neo4jDriver:
     def __init__(self):
         self.driver = None
+        self._lock = asyncio.Lock()
 
-    def init_app(self):
-        if self.driver is None:
-            self.driver = AsyncGraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
+    async def init_app(self):
+        # lock so concurrent callers can't each create a driver
+        async with self._lock:
+            if self.driver is None:
+                self.driver = AsyncGraphDatabase.driver(
+                    NEO4J_URI,
+                    auth=(NEO4J_USER, NEO4J_PASSWORD),
+                    max_connection_pool_size=NEO4J_POOL,
+                    connection_acquisition_timeout=NEO4J_ACQ_TIMEOUT,
+                    keep_alive=True,
+                )
 
     async def close(self):
         if self.driver:
             await self.driver.close()
             self.driver = None
 
-    async def execute_read(self, cypher: str, params: dict = None):
+    async def execute_read(self, cypher: str, params: dict = None, timeout: float = None):
+        records, keys = await self._read(cypher, params, timeout)
+        # data() also turns nodes/relationships/paths into plain dicts
+        return [rec.data() for rec in records]
+
+    async def execute_read_values(self, cypher: str, params: dict = None, timeout: float = None):
+        # returns (keys, rows) with each row a tuple of values in key order,
+        # for callers that only project scalars and don't need a dict per record
+        records, keys = await self._read(cypher, params, timeout)
+        # Record is a tuple subclass, so records already are the rows
+        return keys, records
+
+    async def _read(self, cypher: str, params: dict = None, timeout: float = None):
         params = params or {}
-        async with self.driver.session() as session:
-            result = await session.run(cypher, params)
-            records = []
-            async for rec in result:
-                records.append(rec.data())
-            return records
+        # server-side timeout so a slow read can't hold a pooled connection indefinitely
+        if timeout is not None:
+            cypher = neo4j.Query(cypher, timeout=timeout)
+        # execute_query manages the session/transaction for us; naming the
+        # database skips the home-db lookup round-trip
+        try:
+            records, summary, keys = await self.driver.execute_query(
+                cypher, params, database_=NEO4J_DATABASE, routing_=neo4j.RoutingControl.READ
+            )
+        except neo4j.exceptions.ClientError as e:
+            # TransactionTimedOut / TransactionTimedOutClientConfiguration;
+            # execute_query doesn't retry these
+            if e.code and e.code.startswith("Neo.ClientError.Transaction.TransactionTimedOut"):
+                raise QueryTimeout(e.message) from e
+            raise
+        return records, keys
 
     async def execute_write(self, cypher: str, params: dict = None):
         params = params or {}
-        async with self.driver.session() as session:
-            result = await session.run(cypher, params)
-            # return records if any
-            records = []
-            async for rec in result:
-                records.append(rec.data())
-            return records
+        records, summary, keys = await self.driver.execute_query(
+            cypher, params, database_=NEO4J_DATABASE, routing_=neo4j.RoutingControl.WRITE
+        )
+        # return records if any
+        return [rec.data() for rec in records]
 
 neo4j_driver = Neo4jDriver()
@@ -1,5 +1,5 @@
 # app/schemas.py
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from typing import Optional
 from uuid import uuid4
 
@@ -9,6 +9,8 @@ class UserCreate(BaseModel):
     bio: Optional[str] = None
 
 class UserOut(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     id: str
     username: str
     name: Optional[str] = None
@@ -19,6 +21,8 @@ class PostCreate(BaseModel):
     content: str = Field(..., max_length=500)
 
 class PostOut(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     id: str
     author_username: str
     content: str
@@ -31,3 +35,27 @@ class FollowAction(BaseModel):
 class LikeAction(BaseModel):
     username: str
     post_id: str
+
+# Batch payloads: each is written with a single UNWIND query, so the size is
+# capped to keep one request from opening an arbitrarily large transaction
+MAX_BATCH_SIZE = 1000
+
+class FollowBatch(BaseModel):
+    items: list[FollowAction] = Field(..., max_length=MAX_BATCH_SIZE)
+
+class LikeBatch(BaseModel):
+    items: list[LikeAction] = Field(..., max_length=MAX_BATCH_SIZE)
+
+class PostBatch(BaseModel):
+    items: list[PostCreate] = Field(..., max_length=MAX_BATCH_SIZE)
+
+# In every batch response, skipped holds the positions in the request's items
+# that were not applied because a user or post they refer to was not found
+class BatchOut(BaseModel):
+    # items whose users/post exist, including ones that already were applied
+    matched: int
+    skipped: list[int]
+
+class PostBatchOut(BaseModel):
+    created: list[PostOut]
+    skipped: list[int]